@@ -1,23 +1,62 @@
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi import FastAPI, HTTPException, Query, Depends, Request
+from fastapi.responses import ORJSONResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable, Union
 import uvicorn
 import time
-from telegram_client import telegram_service
+import asyncio
+from contextlib import asynccontextmanager
+import os
+import queue
+import atexit
+import logging
+import logging.handlers
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from telethon import TelegramClient
 
-app = FastAPI(
-    title="Telegram API Gateway",
-    description="API для доступа к Telegram через личный аккаунт",
-    version="1.0.0"
-)
+# Продакшен-режим (PROD=1): без документации API и с логированием уровня WARNING
+PROD = os.getenv("PROD") == "1"
+
+# Логирование через очередь: запись в stdout выполняется в фоновом потоке,
+# чтобы не блокировать цикл событий. При переполнении очереди записи отбрасываются.
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+def _setup_logging(logger: logging.Logger):
+    """Подключить очередь и поток записи логов (один раз на процесс)"""
+    log_queue = queue.Queue(maxsize=10000)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(_DroppingQueueHandler(log_queue))
+
+logger = logging.getLogger("tg_gateway")
+# При запуске через `python main.py` модуль импортируется дважды (как __main__
+# и как main из uvicorn.run): повторная настройка дублировала бы каждую строку лога
+if not logger.handlers:
+    _setup_logging(logger)
+logger.setLevel(os.getenv("LOG_LEVEL", "WARNING" if PROD else "INFO").upper())
+logger.propagate = False
+
+# Импортируется после настройки логирования: сервис пишет в дочерний логгер уже при создании
+from telegram_client import DialogRec, telegram_service
 
 # Модели данных для запросов
 class SendMessageRequest(BaseModel):
-    chat_id: int
-    message: str
+    chat_id: int = Field(description="ID чата для отправки сообщения")
+    message: str = Field(description="Текст сообщения")
 
 class JoinChatRequest(BaseModel):
-    invite_link: str
+    invite_link: str = Field(description="Ссылка приглашения или username канала")
 
 # Модели ответов
 class DialogResponse(BaseModel):
@@ -37,67 +76,344 @@ class StatusResponse(BaseModel):
     status: str
     message: Optional[str] = None
 
+def status_response(result: Dict[str, Any]) -> Response:
+    """
+    Проверить результат по StatusResponse и сериализовать его за один проход
+
+    Заменяет response_model=StatusResponse, при котором FastAPI повторно
+    валидирует уже проверенную модель и прогоняет ее через jsonable_encoder.
+    """
+    return Response(
+        content=StatusResponse.model_validate(result).model_dump_json(),
+        media_type="application/json"
+    )
+
+def json_body_schema(model) -> Dict[str, Any]:
+    """Описание тела запроса для OpenAPI у эндпоинтов, разбирающих JSON вручную"""
+    return {
+        "requestBody": {
+            "content": {"application/json": {"schema": model.model_json_schema()}},
+            "required": True
+        }
+    }
+
+async def read_json_body(request: Request) -> Dict[str, Any]:
+    """Прочитать тело запроса как JSON-объект без построения Pydantic-модели"""
+    try:
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        body = None
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=422, detail="Тело запроса должно быть JSON-объектом")
+    return body
+
+def parse_chat_id(value: Any) -> Optional[int]:
+    """
+    Разобрать chat_id из JSON: целое число или строка из цифр (возможно, с минусом)
+
+    Дробные числа, bool и прочие строки не принимаются (None), чтобы не
+    отправить сообщение в чужой чат из-за округления или приведения типов.
+    """
+    if type(value) is int:
+        return value
+    if isinstance(value, str):
+        digits = value[1:] if value.startswith("-") else value
+        if digits.isascii() and digits.isdigit():
+            return int(value)
+    return None
+
+# Число процессов, которое uvicorn из Procfile берет из WEB_CONCURRENCY. Поддерживается
+# только один процесс: несколько открывали бы один файл сессии Telethon (SQLite),
+# в который клиент пишет сущности и состояние, и получали "database is locked"
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+WEB_CONCURRENCY_ERROR = (
+    "WEB_CONCURRENCY > 1 не поддерживается: все процессы использовали бы "
+    "один файл сессии Telegram. Запустите один процесс на экземпляр приложения."
+)
+
+# Время удержания простаивающего keep-alive соединения (секунд). Должно быть больше
+# таймаута простоя балансировщика (обычно 60 с), иначе он будет получать закрытые соединения
+KEEP_ALIVE_TIMEOUT = 75
+
+# Успешные запросы быстрее этого порога не логируются (например, ответы из кеша)
+SLOW_REQUEST_US = 10_000  # 10 мс
+
+# Кеш результата проверки авторизации (только успешной)
+AUTH_CACHE_TTL = 30  # секунд
+_auth_cache = {"ok": False, "ts": 0.0}
+
+def invalidate_auth_cache():
+    """Сбросить кеш проверки авторизации"""
+    _auth_cache["ok"] = False
+    _auth_cache["ts"] = 0.0
+
+def mark_auth_ok():
+    """Запомнить успешную проверку авторизации на AUTH_CACHE_TTL секунд"""
+    _auth_cache["ok"] = True
+    _auth_cache["ts"] = time.monotonic()
+
+def is_auth_cached() -> bool:
+    """Есть ли свежий результат успешной проверки авторизации"""
+    return _auth_cache["ok"] and time.monotonic() - _auth_cache["ts"] < AUTH_CACHE_TTL
+
 # Вспомогательная функция для проверки авторизации
 async def check_telegram_auth():
-    """Проверяет подключение и авторизацию Telegram клиента"""
-    if not telegram_service.client or not telegram_service.client.is_connected():
+    """
+    Проверяет подключение и авторизацию Telegram клиента
+
+    Используется как зависимость: Depends(check_telegram_auth)
+    """
+    if is_auth_cached():
+        return
+    
+    client = telegram_service.client
+    if client is None or not client.is_connected():
+        invalidate_auth_cache()
         raise HTTPException(status_code=503, detail="Telegram клиент не подключен")
     
-    if not await telegram_service.client.is_user_authorized():
+    if not await client.is_user_authorized():
+        invalidate_auth_cache()
         raise HTTPException(status_code=401, detail="Telegram сессия не авторизована")
+    
+    mark_auth_ok()
+
+# Объединение одинаковых одновременных запросов (single-flight):
+# пока запрос к Telegram с тем же ключом выполняется, новые вызовы ждут его результат
+_inflight: Dict[Tuple, asyncio.Future] = {}
 
-@app.on_event("startup")
-async def startup_event():
-    """Событие запуска приложения"""
+async def coalesce(key: Tuple, factory: Callable[[], Awaitable[Any]]) -> Any:
+    """Выполнить factory() один раз для всех одновременных вызовов с одинаковым key"""
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(factory())
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: отмена одного из ожидающих запросов не отменяет общий вызов
+    return await asyncio.shield(future)
+
+# Общий кеш диалогов в Redis (включается переменной REDIS_URL).
+# Нужен при запуске нескольких экземпляров приложения: список диалогов загружается
+# из Telegram одним экземпляром (под блокировкой в Redis) и используется остальными.
+REDIS_URL = os.getenv("REDIS_URL")
+SHARED_DIALOGS_KEY = "tg:dialogs"
+SHARED_DIALOGS_LIMIT = 200
+SHARED_DIALOGS_TTL = 600  # 10 минут, как у локального кеша
+SHARED_DIALOGS_LOCK_KEY = "tg:dialogs:lock"
+SHARED_DIALOGS_LOCK_TTL = 30  # секунд, с запасом на загрузку диалогов из Telegram
+SHARED_DIALOGS_WAIT = 5.0  # сколько ждать, пока диалоги загрузит другой экземпляр
+SHARED_DIALOGS_POLL = 0.1
+_redis: Optional[aioredis.Redis] = None
+
+# Ответы /dialogs по значению limit для последнего прочитанного из Redis снимка
+_shared_json_by_limit: Tuple[bytes, Dict[int, bytes]] = (b"", {})
+
+async def store_shared_dialogs(force_refresh: bool = False) -> bytes:
+    """Загрузить диалоги через telegram_service и сохранить их JSON в Redis"""
+    # В Redis попадает только свежий снимок, и живет он там не дольше, чем
+    # остается ему до истечения TTL: иначе устаревшие данные продлевались бы бесконечно
+    dialogs = await telegram_service.get_dialogs(
+        limit=SHARED_DIALOGS_LIMIT, force_refresh=force_refresh, allow_stale=False
+    )
+    ttl = max(SHARED_DIALOGS_TTL - telegram_service.get_cache_info()["age_seconds"], 1)
+    blob = orjson.dumps(dialogs)
+    try:
+        await _redis.set(SHARED_DIALOGS_KEY, blob, ex=ttl)
+    except RedisError as e:
+        logger.warning("⚠️ Не удалось сохранить диалоги в Redis: %s", e)
+    return blob
+
+async def load_shared_dialogs(force_refresh: bool = False) -> Optional[bytes]:
+    """
+    Получить JSON полного списка диалогов из Redis (None, если Redis недоступен)
+
+    При промахе диалоги из Telegram загружает только экземпляр, взявший
+    блокировку SHARED_DIALOGS_LOCK_KEY; остальные до SHARED_DIALOGS_WAIT
+    секунд ждут появления ключа и лишь затем загружают диалоги сами.
+    """
+    if force_refresh:
+        return await store_shared_dialogs(force_refresh=True)
+    
+    try:
+        blob = await _redis.get(SHARED_DIALOGS_KEY)
+        if blob is not None:
+            return blob
+        
+        lock = _redis.lock(SHARED_DIALOGS_LOCK_KEY, timeout=SHARED_DIALOGS_LOCK_TTL)
+        if await lock.acquire(blocking=False):
+            try:
+                return await store_shared_dialogs()
+            finally:
+                try:
+                    await lock.release()
+                except RedisError:
+                    # Блокировка уже истекла или Redis недоступен — она снимется по таймауту
+                    pass
+        
+        deadline = time.monotonic() + SHARED_DIALOGS_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(SHARED_DIALOGS_POLL)
+            blob = await _redis.get(SHARED_DIALOGS_KEY)
+            if blob is not None:
+                return blob
+    except RedisError as e:
+        logger.warning("⚠️ Redis недоступен, используем локальный кеш: %s", e)
+        return None
+    
+    logger.warning("⚠️ Не дождались диалогов в Redis, загружаем сами")
+    return await store_shared_dialogs()
+
+async def load_dialogs(limit: int, force_refresh: bool = False) -> List[Union[DialogRec, Dict[str, Any]]]:
+    """
+    Получить диалоги через общий кеш Redis, если он настроен
+
+    В Redis хранится полный список (до 200 диалогов) в виде JSON,
+    запрошенный limit применяется при чтении. При недоступности Redis
+    диалоги берутся напрямую из telegram_service.
+
+    Из telegram_service приходят записи DialogRec, из Redis — словари
+    с теми же ключами; в JSON (orjson) обе формы сериализуются одинаково.
+    """
+    blob = await load_shared_dialogs(force_refresh) if _redis is not None else None
+    if blob is None:
+        return await telegram_service.get_dialogs(limit=limit, force_refresh=force_refresh)
+    return orjson.loads(blob)[:limit]
+
+async def load_dialogs_json(limit: int, force_refresh: bool = False) -> bytes:
+    """
+    Получить диалоги в виде готового JSON-тела ответа
+
+    Без Redis используется сериализация, закешированная в telegram_service
+    по значению limit, поэтому ответ из кеша не сериализуется заново.
+    С Redis ответы по limit запоминаются для последнего прочитанного снимка:
+    пока он не изменился, JSON из Redis не разбирается повторно, а если
+    диалогов не больше limit, снимок отдается как есть.
+    """
+    global _shared_json_by_limit
+    blob = await load_shared_dialogs(force_refresh) if _redis is not None else None
+    if blob is None:
+        return await telegram_service.get_dialogs_json(limit=limit, force_refresh=force_refresh)
+    
+    snapshot, by_limit = _shared_json_by_limit
+    if blob != snapshot:
+        by_limit = {}
+        _shared_json_by_limit = (blob, by_limit)
+    
+    body = by_limit.get(limit)
+    if body is None:
+        dialogs = orjson.loads(blob)
+        body = blob if len(dialogs) <= limit else orjson.dumps(dialogs[:limit])
+        by_limit[limit] = body
+    return body
+
+async def clear_shared_dialogs_cache():
+    """Удалить диалоги из общего кеша Redis"""
+    if _redis is None:
+        return
+    try:
+        await _redis.delete(SHARED_DIALOGS_KEY)
+    except RedisError as e:
+        logger.warning("⚠️ Не удалось очистить кеш в Redis: %s", e)
+
+async def get_shared_cache_info() -> Optional[Dict[str, Any]]:
+    """Получить информацию об общем кеше Redis (None, если Redis не настроен)"""
+    if _redis is None:
+        return None
+    try:
+        async with _redis.pipeline(transaction=False) as pipe:
+            ttl, size = await pipe.ttl(SHARED_DIALOGS_KEY).strlen(SHARED_DIALOGS_KEY).execute()
+    except RedisError as e:
+        return {"backend": "redis", "status": "error", "detail": str(e)}
+    return {
+        "backend": "redis",
+        "status": "active" if ttl > 0 else "empty",
+        "ttl_seconds": max(ttl, 0),
+        "size_bytes": size
+    }
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и завершение приложения: подключение к Telegram и Redis"""
+    global _redis
+    # Проверка для запуска через uvicorn (Procfile); python main.py проверяет это до старта
+    if WEB_CONCURRENCY > 1:
+        raise RuntimeError(WEB_CONCURRENCY_ERROR)
+    invalidate_auth_cache()
+    if REDIS_URL:
+        _redis = aioredis.from_url(REDIS_URL)
+        # Диалоги обновляются по промаху в Redis, а не фоновым таймером в каждом экземпляре
+        telegram_service.background_refresh = False
+        logger.info("✅ Общий кеш диалогов: Redis")
     try:
         await telegram_service.start_client()
-        print("✅ Telegram клиент успешно подключен")
+        logger.info("✅ Telegram клиент успешно подключен")
     except ValueError as e:
-        print(f"⚠️ Предупреждение: {e}")
-        print("ℹ️ API будет доступно, но эндпоинты Telegram не будут работать до авторизации")
+        logger.warning("⚠️ Предупреждение: %s", e)
+        logger.warning("ℹ️ API будет доступно, но эндпоинты Telegram не будут работать до авторизации")
     except Exception as e:
-        print(f"❌ Критическая ошибка подключения к Telegram: {e}")
+        logger.error("❌ Критическая ошибка подключения к Telegram: %s", e)
         raise e
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Событие завершения работы приложения"""
+    
+    yield
+    
+    invalidate_auth_cache()
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
     try:
         await telegram_service.disconnect_client()
-        print("✅ Telegram клиент отключен")
+        logger.info("✅ Telegram клиент отключен")
     except Exception as e:
-        print(f"❌ Ошибка при отключении Telegram клиента: {e}")
+        logger.error("❌ Ошибка при отключении Telegram клиента: %s", e)
+
+app = FastAPI(
+    title="Telegram API Gateway",
+    description="API для доступа к Telegram через личный аккаунт",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    docs_url=None if PROD else "/docs",
+    redoc_url=None if PROD else "/redoc",
+    openapi_url=None if PROD else "/openapi.json",
+    lifespan=lifespan
+)
+
+# Сжатие ответов больше 1 КБ (в основном /dialogs и /messages);
+# маленькие частые ответы (/health, /dialogs/cache/info) не сжимаются
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=1)
+
+# Ответ корневого эндпоинта статичен, поэтому сериализуется один раз при импорте
+_ROOT_BYTES = orjson.dumps({
+    "message": "Telegram API Gateway",
+    "version": "1.1.0",
+    "features": [
+        "✅ Кеширование диалогов (TTL 10 мин)",
+        "⚡ Быстрые ответы из кеша",
+        "📊 Логирование производительности",
+        "🔄 Управление кешем"
+    ],
+    "endpoints": {
+        "health": "GET /health - проверить статус сервиса и кеша",
+        "dialogs": "GET /dialogs?limit=50&force_refresh=false - получить список чатов",
+        "dialogs_refresh": "POST /dialogs/refresh - обновить кеш диалогов",
+        "cache_info": "GET /dialogs/cache/info - информация о кеше",
+        "cache_clear": "DELETE /dialogs/cache - очистить кеш",
+        "messages": "GET /messages?chat_id=ID&limit=20 - получить сообщения",
+        "send_message": "POST /sendMessage - отправить сообщение",
+        "join_chat": "POST /joinChat - вступить в чат",
+        "init_session": "POST /init-session - инициализировать сессию (только локально)"
+    },
+    "docs": "/docs - интерактивная документация API"
+})
 
 @app.get("/")
 async def root():
     """Корневой эндпоинт с информацией о API"""
-    return {
-        "message": "Telegram API Gateway",
-        "version": "1.1.0",
-        "features": [
-            "✅ Кеширование диалогов (TTL 10 мин)",
-            "⚡ Быстрые ответы из кеша",
-            "📊 Логирование производительности",
-            "🔄 Управление кешем"
-        ],
-        "endpoints": {
-            "health": "GET /health - проверить статус сервиса и кеша",
-            "dialogs": "GET /dialogs?limit=50&force_refresh=false - получить список чатов",
-            "dialogs_refresh": "POST /dialogs/refresh - обновить кеш диалогов",
-            "cache_info": "GET /dialogs/cache/info - информация о кеше",
-            "cache_clear": "DELETE /dialogs/cache - очистить кеш",
-            "messages": "GET /messages?chat_id=ID&limit=20 - получить сообщения",
-            "send_message": "POST /sendMessage - отправить сообщение",
-            "join_chat": "POST /joinChat - вступить в чат",
-            "init_session": "POST /init-session - инициализировать сессию (только локально)"
-        },
-        "docs": "/docs - интерактивная документация API"
-    }
+    return Response(content=_ROOT_BYTES, media_type="application/json")
 
-@app.get("/dialogs", response_model=List[DialogResponse])
+@app.get("/dialogs", responses={200: {"model": List[DialogResponse]}})
 async def get_dialogs(
     limit: int = Query(50, description="Количество диалогов для получения", ge=1, le=200),
-    force_refresh: bool = Query(False, description="Принудительно обновить кеш")
+    force_refresh: bool = Query(False, description="Принудительно обновить кеш"),
+    _: None = Depends(check_telegram_auth)
 ):
     """
     Получить список доступных чатов и каналов с кешированием
@@ -112,24 +428,37 @@ async def get_dialogs(
     - Типе (user/group/channel/supergroup)
     - Количестве непрочитанных сообщений
     - Дате последнего сообщения
+
+    Формат ответа: [{"id": int, "name": str, "type": str, "unread_count": int,
+    "last_message_date": str | null}]. Ответ не валидируется повторно через
+    DialogResponse — данные уже собраны в этом формате в telegram_service,
+    а JSON для каждого limit сериализуется один раз на снимок кеша.
     """
-    start_time = time.time()
-    await check_telegram_auth()
+    start_ns = time.perf_counter_ns()
     
     try:
-        dialogs = await telegram_service.get_dialogs(limit=limit, force_refresh=force_refresh)
-        duration = time.time() - start_time
-        print(f"📊 API /dialogs: {len(dialogs)} диалогов за {duration:.2f}с (limit={limit}, refresh={force_refresh})")
-        return dialogs
+        body = await coalesce(
+            ("dialogs", limit, force_refresh),
+            lambda: load_dialogs_json(limit=limit, force_refresh=force_refresh)
+        )
+        duration_us = (time.perf_counter_ns() - start_ns) // 1000
+        if duration_us > SLOW_REQUEST_US:
+            logger.info(
+                "📊 API /dialogs: %d байт за %d мкс (limit=%d, refresh=%s)",
+                len(body), duration_us, limit, force_refresh,
+                extra={"duration_us": duration_us, "size": len(body)}
+            )
+        return Response(content=body, media_type="application/json")
     except Exception as e:
-        duration = time.time() - start_time
-        print(f"❌ API /dialogs ошибка за {duration:.2f}с: {str(e)}")
+        duration_us = (time.perf_counter_ns() - start_ns) // 1000
+        logger.error("❌ API /dialogs ошибка за %d мкс: %s", duration_us, e, extra={"duration_us": duration_us})
         raise HTTPException(status_code=500, detail=f"Ошибка получения диалогов: {str(e)}")
 
-@app.get("/messages", response_model=List[MessageResponse])
+@app.get("/messages", responses={200: {"model": List[MessageResponse]}})
 async def get_messages(
     chat_id: int = Query(..., description="ID чата для получения сообщений"),
-    limit: int = Query(20, description="Количество сообщений для получения", ge=1, le=100)
+    limit: int = Query(20, description="Количество сообщений для получения", ge=1, le=100),
+    _: None = Depends(check_telegram_auth)
 ):
     """
     Получить последние сообщения из указанного чата
@@ -137,48 +466,63 @@ async def get_messages(
     Параметры:
     - chat_id: ID чата (обязательный)
     - limit: количество сообщений (по умолчанию 20, максимум 100)
+
+    Формат ответа: [{"id": int, "text": str, "date": str, "sender": str}].
+    Ответ не валидируется повторно через MessageResponse.
     """
-    start_time = time.time()
-    await check_telegram_auth()
+    start_ns = time.perf_counter_ns()
     
     try:
-        messages = await telegram_service.get_messages(chat_id, limit)
-        duration = time.time() - start_time
-        print(f"📨 API /messages: {len(messages)} сообщений из чата {chat_id} за {duration:.2f}с")
-        return messages
+        messages = await coalesce(
+            ("messages", chat_id, limit),
+            lambda: telegram_service.get_messages(chat_id, limit)
+        )
+        duration_us = (time.perf_counter_ns() - start_ns) // 1000
+        if duration_us > SLOW_REQUEST_US:
+            logger.info(
+                "📨 API /messages: %d сообщений из чата %d за %d мкс",
+                len(messages), chat_id, duration_us,
+                extra={"duration_us": duration_us, "n": len(messages)}
+            )
+        return ORJSONResponse(messages)
     except ValueError as e:
-        duration = time.time() - start_time
-        print(f"❌ API /messages ошибка 404 за {duration:.2f}с: {str(e)}")
+        duration_us = (time.perf_counter_ns() - start_ns) // 1000
+        logger.warning("❌ API /messages ошибка 404 за %d мкс: %s", duration_us, e, extra={"duration_us": duration_us})
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        duration = time.time() - start_time
-        print(f"❌ API /messages ошибка за {duration:.2f}с: {str(e)}")
+        duration_us = (time.perf_counter_ns() - start_ns) // 1000
+        logger.error("❌ API /messages ошибка за %d мкс: %s", duration_us, e, extra={"duration_us": duration_us})
         raise HTTPException(status_code=500, detail=f"Ошибка получения сообщений: {str(e)}")
 
-@app.post("/sendMessage", response_model=StatusResponse)
-async def send_message(request: SendMessageRequest):
+@app.post("/sendMessage", responses={200: {"model": StatusResponse}}, openapi_extra=json_body_schema(SendMessageRequest))
+async def send_message(raw: Request, _: None = Depends(check_telegram_auth)):
     """
     Отправить сообщение от лица пользователя
     
-    Тело запроса:
+    Тело запроса (SendMessageRequest, проверяется вручную):
     - chat_id: ID чата для отправки сообщения
     - message: текст сообщения
     """
-    await check_telegram_auth()
+    body = await read_json_body(raw)
+    chat_id = parse_chat_id(body.get("chat_id"))
+    message = body.get("message")
+    if chat_id is None or not isinstance(message, str):
+        raise HTTPException(status_code=422, detail="Ожидаются поля chat_id (integer) и message (string)")
+    
     try:
-        result = await telegram_service.send_message(request.chat_id, request.message)
-        return StatusResponse(**result)
+        result = await telegram_service.send_message(chat_id, message)
+        return status_response(result)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка отправки сообщения: {str(e)}")
 
-@app.post("/joinChat", response_model=StatusResponse)
-async def join_chat(request: JoinChatRequest):
+@app.post("/joinChat", responses={200: {"model": StatusResponse}}, openapi_extra=json_body_schema(JoinChatRequest))
+async def join_chat(raw: Request, _: None = Depends(check_telegram_auth)):
     """
     Вступить в чат или канал по ссылке
     
-    Тело запроса:
+    Тело запроса (JoinChatRequest, проверяется вручную):
     - invite_link: ссылка приглашения или username канала (например, https://t.me/channel_name)
     
     Поддерживаемые форматы ссылок:
@@ -186,10 +530,13 @@ async def join_chat(request: JoinChatRequest):
     - https://t.me/channel_name
     - @channel_name
     """
-    await check_telegram_auth()
+    invite_link = (await read_json_body(raw)).get("invite_link")
+    if not isinstance(invite_link, str):
+        raise HTTPException(status_code=422, detail="Ожидается поле invite_link (string)")
+    
     try:
-        result = await telegram_service.join_chat(request.invite_link)
-        return StatusResponse(**result)
+        result = await telegram_service.join_chat(invite_link)
+        return status_response(result)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -203,6 +550,7 @@ async def init_session():
     Этот эндпоинт поможет в случае, если сессия потеряна или повреждена.
     Работает только в среде с интерактивным терминалом.
     """
+    invalidate_auth_cache()
     try:
         # Отключаем текущий клиент, если он есть
         if telegram_service.client:
@@ -210,13 +558,14 @@ async def init_session():
             telegram_service.client = None
         
         # Пытаемся создать новую сессию
-        telegram_service.client = TelegramClient(
+        client = TelegramClient(
             telegram_service.session_name, 
             telegram_service.api_id, 
             telegram_service.api_hash
         )
+        telegram_service.client = client
         
-        await telegram_service.client.start()
+        await client.start()
         return {"status": "success", "message": "Сессия успешно инициализирована"}
         
     except EOFError:
@@ -228,23 +577,29 @@ async def init_session():
         raise HTTPException(status_code=500, detail=f"Ошибка инициализации сессии: {str(e)}")
 
 @app.post("/dialogs/refresh")
-async def refresh_dialogs_cache():
+async def refresh_dialogs_cache(_: None = Depends(check_telegram_auth)):
     """
     Принудительно обновить кеш диалогов
     
     Полезно для получения актуального списка чатов без ожидания истечения TTL
     """
-    start_time = time.time()
-    await check_telegram_auth()
+    start_time = time.perf_counter()
     
     try:
         # Очищаем кеш и получаем свежие данные
         telegram_service.clear_dialogs_cache()
-        dialogs = await telegram_service.get_dialogs(limit=200, force_refresh=True)
-        duration = time.time() - start_time
+        await clear_shared_dialogs_cache()
+        dialogs = await load_dialogs(limit=SHARED_DIALOGS_LIMIT, force_refresh=True)
+        duration = time.perf_counter() - start_time
         
         cache_info = telegram_service.get_cache_info()
-        print(f"🔄 Кеш обновлен: {len(dialogs)} диалогов за {duration:.2f}с")
+        shared_cache_info = await get_shared_cache_info()
+        if shared_cache_info is not None:
+            cache_info["shared"] = shared_cache_info
+        logger.info(
+            "🔄 Кеш обновлен: %d диалогов за %.2fс", len(dialogs), duration,
+            extra={"duration": duration, "n": len(dialogs)}
+        )
         
         return {
             "status": "refreshed",
@@ -253,8 +608,8 @@ async def refresh_dialogs_cache():
             "cache_info": cache_info
         }
     except Exception as e:
-        duration = time.time() - start_time
-        print(f"❌ Ошибка обновления кеша за {duration:.2f}с: {str(e)}")
+        duration = time.perf_counter() - start_time
+        logger.error("❌ Ошибка обновления кеша за %.2fс: %s", duration, e, extra={"duration": duration})
         raise HTTPException(status_code=500, detail=f"Ошибка обновления кеша: {str(e)}")
 
 @app.get("/dialogs/cache/info")
@@ -267,8 +622,12 @@ async def get_cache_info():
     - Количество диалогов в кеше
     - Возраст кеша в секундах
     - TTL кеша
+    - Состояние общего кеша Redis (shared), если он настроен
     """
     cache_info = telegram_service.get_cache_info()
+    shared_cache_info = await get_shared_cache_info()
+    if shared_cache_info is not None:
+        cache_info["shared"] = shared_cache_info
     return {
         "cache": cache_info,
         "timestamp": time.time()
@@ -278,22 +637,46 @@ async def get_cache_info():
 async def clear_cache():
     """Очистить кеш диалогов"""
     telegram_service.clear_dialogs_cache()
+    await clear_shared_dialogs_cache()
     return {
         "status": "cleared",
         "message": "Кеш диалогов очищен"
     }
 
+@app.get("/health/live")
+async def liveness_check():
+    """Проверка живости процесса (liveness probe) — без обращений к Telegram"""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Проверка готовности к обработке запросов (readiness probe)
+
+    Возвращает 503, если Telegram клиент не подключен или не авторизован.
+    """
+    result = await health_check()
+    if result["status"] != "healthy" or not result["authorized"]:
+        return ORJSONResponse(result, status_code=503)
+    return result
+
 @app.get("/health")
 async def health_check():
     """Проверка состояния сервиса"""
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     try:
         # Проверяем подключение к Telegram
-        if telegram_service.client and telegram_service.client.is_connected():
-            is_authorized = await telegram_service.client.is_user_authorized()
+        client = telegram_service.client
+        if client is not None and client.is_connected():
+            # Свежий результат успешной проверки авторизации избавляет от запроса к Telegram
+            is_authorized = is_auth_cached()
+            if not is_authorized:
+                is_authorized = await client.is_user_authorized()
+                if is_authorized:
+                    mark_auth_ok()
             cache_info = telegram_service.get_cache_info()
-            duration = time.time() - start_time
+            duration = time.perf_counter() - start_time
             
             return {
                 "status": "healthy", 
@@ -312,10 +695,27 @@ async def health_check():
         return {"status": "error", "detail": str(e)}
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level="info"
-    ) 
\ No newline at end of file
+    if WEB_CONCURRENCY > 1:
+        raise SystemExit(WEB_CONCURRENCY_ERROR)
+    
+    # DEV=1 — единственный переключатель режима разработки: автоперезагрузка при изменении кода
+    if os.getenv("DEV") == "1":
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=True,
+            log_level="info"
+        )
+    else:
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=False,
+            loop="uvloop",
+            http="httptools",
+            access_log=False,
+            timeout_keep_alive=KEEP_ALIVE_TIMEOUT,
+            log_level="info"
+        ) 
\ No newline at end of file
@@ -1,25 +1,119 @@
 import os
 import asyncio
 import time
+import threading
+import orjson
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import List, Dict, Any, Optional
 from telethon import TelegramClient, types, errors
 from telethon.tl.types import User, Chat, Channel
 from dotenv import load_dotenv
 
-# Загружаем переменные окружения
-load_dotenv()
+__all__ = ["DialogRec", "TelegramService", "telegram_service"]
+
+# Дочерний логгер "tg_gateway": записи уходят в общий обработчик приложения
+logger = logging.getLogger("tg_gateway.telegram")
+
+# Загружаем переменные окружения (однократно на процесс)
+_DOTENV_LOADED = False
+_DOTENV_LOCK = threading.Lock()
+
+def _load_env_once():
+    """Загрузить .env один раз; повторные вызовы ничего не делают"""
+    global _DOTENV_LOADED
+    if _DOTENV_LOADED:
+        return
+    with _DOTENV_LOCK:
+        if not _DOTENV_LOADED:
+            load_dotenv()
+            _DOTENV_LOADED = True
+
+_load_env_once()
+
+# Настройки из окружения читаются один раз при импорте
+_ENV = os.environ
+API_ID = _ENV.get('API_ID')
+API_HASH = _ENV.get('API_HASH')
+SESSION_NAME = _ENV.get('SESSION_NAME', 'telegram_session')
+SESSION_B64 = _ENV.get('SESSION_FILE_BASE64')
+
+# Первые два байта любого gzip-потока
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Тип чата по классу сущности Telethon (Channel разбирается отдельно по флагу broadcast)
+_CHAT_TYPE = {User: "user", Chat: "group"}
+
+# Размер LRU-кеша сущностей (чатов, каналов, пользователей)
+ENTITY_CACHE_SIZE = 1024
+
+# Ошибки, после которых сохраненная сущность чата больше не годится
+_ENTITY_ACCESS_ERRORS = (errors.ChatForbiddenError, errors.ChannelPrivateError)
+
+def _chat_type(entity) -> str:
+    """Определить тип чата: user/group/channel/supergroup/unknown"""
+    chat_type = _CHAT_TYPE.get(type(entity))
+    if chat_type is None:
+        if type(entity) is Channel:
+            chat_type = "channel" if entity.broadcast else "supergroup"
+        else:
+            chat_type = "unknown"
+    return chat_type
+
+@dataclass(frozen=True, slots=True)
+class DialogRec:
+    """
+    Запись кеша диалогов
+    
+    slots-класс занимает заметно меньше памяти, чем dict с теми же ключами;
+    orjson сериализует его напрямую в объект с этими полями.
+    """
+    id: int
+    name: str
+    type: str
+    unread_count: int
+    last_message_date: Optional[str]
+
+def _dialog_record(dialog) -> DialogRec:
+    """Запись кеша диалогов для одного диалога Telethon"""
+    entity = dialog.entity
+    eid = entity.id
+    date = dialog.date
+    return DialogRec(
+        eid,
+        dialog.title or ("User " + str(eid)),
+        _chat_type(entity),
+        dialog.unread_count,
+        date.isoformat() if date else None
+    )
 
 class TelegramService:
     def __init__(self):
-        self.api_id = os.getenv('API_ID')
-        self.api_hash = os.getenv('API_HASH')
-        self.session_name = os.getenv('SESSION_NAME', 'telegram_session')
+        self.api_id = API_ID
+        self.api_hash = API_HASH
+        self.session_name = SESSION_NAME
+        self._session_path = f"{self.session_name}.session"
         self.client = None
+        # Общее подключение: первый вызов start_client создает его, остальные ждут результат
+        self._client_future: Optional[asyncio.Future] = None
         
-        # Кеширование диалогов
-        self._dialogs_cache = None
-        self._dialogs_cache_time = 0
+        # Кеширование диалогов: неизменяемый кортеж неизменяемых записей DialogRec,
+        # записи передаются вызывающему коду по ссылке и не копируются
+        self._dialogs_cache: Optional[tuple] = None
+        self._dialogs_cache_time = 0  # по time.monotonic(), не зависит от коррекции системных часов
         self._cache_ttl = 600  # 10 минут
+        # Сериализованный JSON текущего снимка кеша по значению limit
+        self._dialogs_json_by_limit: Dict[int, bytes] = {}
+        # Фоновое обновление кеша и текущая загрузка диалогов (одна на всех).
+        # background_refresh отключается, если кеш диалогов общий (Redis):
+        # иначе каждый экземпляр приложения обращался бы к Telegram по своему таймеру
+        self.background_refresh = True
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._dialogs_refresh: Optional[asyncio.Task] = None
+        
+        # Кеш сущностей по chat_id/username, чтобы не вызывать get_entity повторно
+        self._entity_cache: "OrderedDict[Any, Any]" = OrderedDict()
         
         if not self.api_id or not self.api_hash:
             raise ValueError("API_ID и API_HASH должны быть установлены в переменных окружения")
@@ -29,39 +123,61 @@ class TelegramService:
     
     def _restore_session_from_env(self):
         """Восстанавливает файл сессии из переменной окружения SESSION_FILE_BASE64"""
-        session_base64 = os.getenv('SESSION_FILE_BASE64')
-        session_file_path = f"{self.session_name}.session"
+        session_base64 = SESSION_B64
+        if not session_base64:
+            return
         
-        if session_base64 and not os.path.exists(session_file_path):
-            try:
-                import base64
-                import gzip
-                
-                # Декодируем base64
-                compressed_data = base64.b64decode(session_base64)
-                
-                # Пытаемся распаковать (если данные сжаты)
-                try:
-                    session_data = gzip.decompress(compressed_data)
-                    print("✅ Сессия восстановлена из сжатой переменной окружения")
-                except gzip.BadGzipFile:
-                    # Если не получилось распаковать, значит данные не сжаты
-                    session_data = compressed_data
-                    print("✅ Сессия восстановлена из переменной окружения")
+        session_file_path = self._session_path
+        if os.path.exists(session_file_path):
+            logger.info("ℹ️ Используется существующий файл сессии")
+            return
+        
+        try:
+            import base64
+            import gzip
+            
+            # Декодируем base64
+            compressed_data = base64.b64decode(session_base64)
+            
+            # Распаковываем, только если данные начинаются с сигнатуры gzip
+            if compressed_data[:2] == GZIP_MAGIC:
+                session_data = gzip.decompress(compressed_data)
+                logger.info("✅ Сессия восстановлена из сжатой переменной окружения")
+            else:
+                session_data = compressed_data
+                logger.info("✅ Сессия восстановлена из переменной окружения")
+            
+            # Записываем файл сессии
+            with open(session_file_path, 'wb') as f:
+                f.write(session_data)
                 
-                # Записываем файл сессии
-                with open(session_file_path, 'wb') as f:
-                    f.write(session_data)
-                    
-            except Exception as e:
-                print(f"❌ Ошибка восстановления сессии: {e}")
-        elif os.path.exists(session_file_path):
-            print("ℹ️ Используется существующий файл сессии")
-        else:
-            print("ℹ️ Файл сессии не найден, потребуется авторизация")
+        except Exception as e:
+            logger.error("❌ Ошибка восстановления сессии: %s", e)
     
     async def start_client(self):
-        """Инициализация и подключение клиента Telegram"""
+        """
+        Инициализация и подключение клиента Telegram
+        
+        Клиент создается и подключается один раз: одновременные вызовы ждут
+        один общий future, а после подключения возвращается готовый результат.
+        """
+        future = self._client_future
+        if future is None:
+            future = self._client_future = asyncio.ensure_future(self._connect())
+            future.add_done_callback(self._on_connect_done)
+        elif future.done():
+            return future.result()
+        # shield: отмена одного вызывающего не прерывает общее подключение
+        return await asyncio.shield(future)
+    
+    def _on_connect_done(self, future: asyncio.Future):
+        """При неудачном подключении сбросить future, чтобы следующий вызов повторил попытку"""
+        if future.cancelled() or future.exception() is not None:
+            if self._client_future is future:
+                self._client_future = None
+    
+    async def _connect(self):
+        """Создать клиент, подключиться и проверить авторизацию"""
         if self.client is None:
             self.client = TelegramClient(self.session_name, self.api_id, self.api_hash)
         
@@ -92,97 +208,142 @@ class TelegramService:
                             "Пожалуйста, выполните авторизацию локально и загрузите файл сессии."
                         )
         
+        if self.background_refresh and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+        
         return self.client
     
     async def disconnect_client(self):
         """Отключение клиента"""
+        self._client_future = None
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._dialogs_refresh is not None:
+            self._dialogs_refresh.cancel()
+            self._dialogs_refresh = None
+        # Сущности хранят access_hash текущего аккаунта; после переподключения
+        # (например, через /init-session) аккаунт может быть другим
+        self._entity_cache.clear()
         if self.client and self.client.is_connected():
             await self.client.disconnect()
     
-    async def get_dialogs(self, limit: int = 50, force_refresh: bool = False) -> List[Dict[str, Any]]:
+    async def _refresh_loop(self):
+        """Периодически обновляет кеш диалогов в фоне (каждые TTL/2)"""
+        while True:
+            await asyncio.sleep(self._cache_ttl / 2)
+            try:
+                await self._refresh_dialogs()
+            except Exception:
+                # Ошибка уже залогирована в _on_dialogs_refreshed, пробуем в следующий раз
+                pass
+    
+    def _schedule_dialogs_refresh(self) -> asyncio.Task:
+        """Запустить загрузку диалогов, если она еще не выполняется"""
+        if self._dialogs_refresh is None:
+            self._dialogs_refresh = asyncio.ensure_future(self._load_dialogs())
+            self._dialogs_refresh.add_done_callback(self._on_dialogs_refreshed)
+        return self._dialogs_refresh
+    
+    def _on_dialogs_refreshed(self, task: asyncio.Task):
+        """Завершение загрузки диалогов: сбрасывает ссылку на задачу и логирует ошибку"""
+        self._dialogs_refresh = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("⚠️ Не удалось обновить кеш диалогов: %s", task.exception())
+    
+    async def _refresh_dialogs(self) -> tuple:
+        """Обновить кеш диалогов и дождаться завершения загрузки"""
+        return await asyncio.shield(self._schedule_dialogs_refresh())
+    
+    async def get_dialogs(self, limit: int = 50, force_refresh: bool = False,
+                          allow_stale: bool = True) -> List[DialogRec]:
         """
         Получить список диалогов (чатов, каналов, групп) с кешированием
         
+        Диалоги возвращаются как записи DialogRec (а не словари); поля
+        записи совпадают с ключами JSON-ответа, orjson сериализует их
+        напрямую (см. get_dialogs_json).
+        
+        Если кеш устарел, сразу возвращаются данные из него, а обновление
+        запускается в фоне (stale-while-revalidate). Запрос ждет загрузки
+        из Telegram только при пустом кеше, при force_refresh или, если
+        allow_stale=False, при устаревшем кеше.
+        
         Args:
             limit: Максимальное количество диалогов (по умолчанию 50, максимум 200)
             force_refresh: Принудительно обновить кеш
+            allow_stale: Разрешить вернуть устаревший кеш
         """
-        start_time = time.time()
+        start_time = time.monotonic()
         
         # Ограничиваем лимит
         limit = min(max(limit, 1), 200)
         
         # Проверяем кеш
-        current_time = time.time()
-        if (not force_refresh and 
-            self._dialogs_cache is not None and 
-            current_time - self._dialogs_cache_time < self._cache_ttl):
-            
-            cached_result = self._dialogs_cache[:limit]
-            print(f"📋 Диалоги получены из кеша за {time.time() - start_time:.2f}с (лимит: {limit})")
-            return cached_result
+        if not force_refresh and self._dialogs_cache is not None:
+            expired = start_time - self._dialogs_cache_time >= self._cache_ttl
+            if not expired or allow_stale:
+                if expired:
+                    self._schedule_dialogs_refresh()
+                
+                cached_result = list(self._dialogs_cache[:limit])
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("📋 Диалоги получены из кеша за %.2fс (лимит: %d)", time.monotonic() - start_time, limit)
+                return cached_result
         
-        await self.start_client()
+        dialogs = await self._refresh_dialogs()
         
-        print(f"🔄 Обновляем кеш диалогов...")
-        dialogs = []
-        count = 0
+        result = list(dialogs[:limit])
+        duration = time.monotonic() - start_time
+        logger.debug("✅ Загружено %d диалогов в кеш за %.2fс (возвращено: %d)", len(dialogs), duration, len(result))
         
-        async for dialog in self.client.iter_dialogs():
-            entity = dialog.entity
-            
-            # Пропускаем архивные диалоги без сообщений
-            if hasattr(dialog, 'archived') and dialog.archived:
-                continue
-                
-            # Определяем тип чата
-            if isinstance(entity, User):
-                chat_type = "user"
-            elif isinstance(entity, Chat):
-                chat_type = "group"
-            elif isinstance(entity, Channel):
-                if entity.broadcast:
-                    chat_type = "channel"
-                else:
-                    chat_type = "supergroup"
-            else:
-                chat_type = "unknown"
-            
-            dialogs.append({
-                "id": entity.id,
-                "name": dialog.title or f"User {entity.id}",
-                "type": chat_type,
-                "unread_count": dialog.unread_count,
-                "last_message_date": dialog.date.isoformat() if dialog.date else None
-            })
-            
-            count += 1
-            # Ограничиваем загрузку для кеша (максимум 200)
-            if count >= 200:
-                break
+        return result
+    
+    async def _load_dialogs(self) -> tuple:
+        """Загрузить диалоги из Telegram и сохранить их в кеш"""
+        load_time = time.monotonic()
+        await self.start_client()
+        
+        logger.debug("🔄 Обновляем кеш диалогов...")
+        # Лимит (максимум 200 для кеша) и исключение архива применяются на стороне Telegram
+        dialogs_raw = await self.client.get_dialogs(limit=200, archived=False)
+        dialogs = [_dialog_record(dialog) for dialog in dialogs_raw]
         
         # Сохраняем в кеш
-        self._dialogs_cache = dialogs
-        self._dialogs_cache_time = current_time
+        self._dialogs_cache = tuple(dialogs)
+        self._dialogs_cache_time = load_time
+        self._dialogs_json_by_limit = {}
+        return self._dialogs_cache
+    
+    async def get_dialogs_json(self, limit: int = 50, force_refresh: bool = False) -> bytes:
+        """
+        То же, что get_dialogs, но в виде готового JSON
         
-        result = dialogs[:limit]
-        duration = time.time() - start_time
-        print(f"✅ Загружено {len(dialogs)} диалогов в кеш за {duration:.2f}с (возвращено: {len(result)})")
+        Сериализация выполняется один раз на каждый limit для текущего
+        снимка кеша; повторные запросы получают уже готовые байты.
+        """
+        limit = min(max(limit, 1), 200)
+        dialogs = await self.get_dialogs(limit=limit, force_refresh=force_refresh)
         
-        return result
+        blob = self._dialogs_json_by_limit.get(limit)
+        if blob is None:
+            blob = orjson.dumps(dialogs)
+            self._dialogs_json_by_limit[limit] = blob
+        return blob
     
     def clear_dialogs_cache(self):
         """Очистить кеш диалогов"""
         self._dialogs_cache = None
         self._dialogs_cache_time = 0
-        print("🗑️ Кеш диалогов очищен")
+        self._dialogs_json_by_limit = {}
+        logger.debug("🗑️ Кеш диалогов очищен")
     
     def get_cache_info(self) -> Dict[str, Any]:
         """Получить информацию о состоянии кеша"""
         if self._dialogs_cache is None:
             return {"status": "empty", "dialogs_count": 0, "age_seconds": 0}
         
-        age = time.time() - self._dialogs_cache_time
+        age = time.monotonic() - self._dialogs_cache_time
         return {
             "status": "active" if age < self._cache_ttl else "expired",
             "dialogs_count": len(self._dialogs_cache),
@@ -190,37 +351,57 @@ class TelegramService:
             "ttl_seconds": self._cache_ttl
         }
     
+    async def _resolve(self, key):
+        """Получить сущность Telegram по chat_id или username с LRU-кешированием"""
+        cache = self._entity_cache
+        entity = cache.get(key)
+        if entity is not None:
+            cache.move_to_end(key)
+            return entity
+        
+        entity = await self.client.get_entity(key)
+        cache[key] = entity
+        if len(cache) > ENTITY_CACHE_SIZE:
+            cache.popitem(last=False)
+        return entity
+    
     async def get_messages(self, chat_id: int, limit: int = 20) -> List[Dict[str, Any]]:
         """Получить сообщения из указанного чата"""
         await self.start_client()
         
         try:
-            entity = await self.client.get_entity(chat_id)
+            entity = await self._resolve(chat_id)
         except ValueError:
             raise ValueError(f"Чат с ID {chat_id} не найден")
         
-        messages = []
-        async for message in self.client.iter_messages(entity, limit=limit):
-            if message.text:
-                messages.append({
+        try:
+            return [
+                {
                     "id": message.id,
                     "text": message.text,
                     "date": message.date.isoformat(),
-                    "sender": await self._get_sender_name(message)
-                })
-        
-        return messages
+                    "sender": self._get_sender_name(message)
+                }
+                async for message in self.client.iter_messages(entity, limit=limit)
+                if message.text
+            ]
+        except _ENTITY_ACCESS_ERRORS:
+            self._entity_cache.pop(chat_id, None)
+            raise
     
     async def send_message(self, chat_id: int, message: str) -> Dict[str, str]:
         """Отправить сообщение в указанный чат"""
         await self.start_client()
         
         try:
-            entity = await self.client.get_entity(chat_id)
+            entity = await self._resolve(chat_id)
             await self.client.send_message(entity, message)
             return {"status": "ok", "message": "Сообщение отправлено успешно"}
         except ValueError:
             raise ValueError(f"Чат с ID {chat_id} не найден")
+        except _ENTITY_ACCESS_ERRORS as e:
+            self._entity_cache.pop(chat_id, None)
+            raise Exception(f"Ошибка при отправке сообщения: {str(e)}")
         except Exception as e:
             raise Exception(f"Ошибка при отправке сообщения: {str(e)}")
     
@@ -228,10 +409,13 @@ class TelegramService:
         """Присоединиться к чату или каналу по ссылке"""
         await self.start_client()
         
+        # Хеш приглашения или username — часть после последнего '/'
+        _, _, tail = invite_link.rpartition('/')
+        
         try:
             # Попытка присоединиться по ссылке
             result = await self.client(types.functions.messages.ImportChatInviteRequest(
-                hash=invite_link.split('/')[-1]
+                hash=tail
             ))
             return {"status": "joined", "message": "Успешно присоединились к чату"}
         except errors.InviteHashExpiredError:
@@ -240,35 +424,31 @@ class TelegramService:
             raise ValueError("Неверная ссылка приглашения")
         except errors.UserAlreadyParticipantError:
             return {"status": "already_joined", "message": "Вы уже состоите в этом чате"}
-        except Exception as e:
+        except Exception:
             # Попытка присоединиться по username
             try:
-                if 't.me/' in invite_link:
-                    username = invite_link.split('/')[-1]
-                    if username.startswith('@'):
-                        username = username[1:]
-                    
-                    entity = await self.client.get_entity(username)
-                    await self.client(types.functions.channels.JoinChannelRequest(entity))
-                    return {"status": "joined", "message": "Успешно присоединились к каналу"}
-                else:
-                    raise Exception(f"Ошибка при присоединении к чату: {str(e)}")
+                username = tail[1:] if tail.startswith('@') else tail
+                entity = await self._resolve(username)
+                await self.client(types.functions.channels.JoinChannelRequest(entity))
+                return {"status": "joined", "message": "Успешно присоединились к каналу"}
             except Exception as inner_e:
                 raise Exception(f"Ошибка при присоединении к чату: {str(inner_e)}")
     
-    async def _get_sender_name(self, message) -> str:
-        """Получить имя отправителя сообщения"""
-        if message.sender:
-            if hasattr(message.sender, 'first_name'):
-                name = message.sender.first_name
-                if hasattr(message.sender, 'last_name') and message.sender.last_name:
-                    name += f" {message.sender.last_name}"
-                return name
-            elif hasattr(message.sender, 'title'):
-                return message.sender.title
-            else:
-                return f"User {message.sender_id}"
-        return "Unknown"
+    def _get_sender_name(self, message) -> str:
+        """Получить имя отправителя сообщения (из уже загруженного message.sender, без запросов в сеть)"""
+        sender = message.sender
+        if sender is None:
+            return "Unknown"
+        
+        # Пользователь: first_name (+ last_name)
+        first = getattr(sender, 'first_name', None)
+        if first is not None:
+            last = getattr(sender, 'last_name', None)
+            return f"{first} {last}" if last else first
+        
+        # Канал или группа: title
+        title = getattr(sender, 'title', None)
+        return title if title is not None else "User " + str(message.sender_id)
 
 # Глобальный экземпляр сервиса
 telegram_service = TelegramService() 
\ No newline at end of file